@@ -9,9 +9,10 @@ import json
 import urllib.request
 import urllib.error
 import sys
+from typing import Any
 
 
-def put_value(node_url, key, value):
+def put_value(node_url: str, key: str, value: str) -> Any:
     """Send PUT request to node"""
     data = {'key': key, 'value': value}
     
@@ -33,7 +34,7 @@ def put_value(node_url, key, value):
         sys.exit(1)
 
 
-def get_value(node_url, key):
+def get_value(node_url: str, key: str) -> Any:
     """Send GET request to node"""
     try:
         with urllib.request.urlopen(f"{node_url}/get?key={key}", timeout=5) as response:
@@ -47,7 +48,7 @@ def get_value(node_url, key):
         sys.exit(1)
 
 
-def get_status(node_url):
+def get_status(node_url: str) -> Any:
     """Get node status"""
     try:
         with urllib.request.urlopen(f"{node_url}/status", timeout=5) as response:
@@ -61,7 +62,7 @@ def get_status(node_url):
         sys.exit(1)
 
 
-def main():
+def main() -> None:
     parser = argparse.ArgumentParser(description='KV Store Client')
     parser.add_argument('--node', required=True, help='Node URL (e.g., http://IP:8000)')
     parser.add_argument('command', choices=['put', 'get', 'status'], help='Command to execute')
@@ -6,290 +6,1201 @@ Lab 2 - Logical Clocks and Replication Consistency
 
 import json
 import argparse
+import heapq
+import io
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import selectors
+import socket
+import struct
+import sys
 import time
 import threading
+from dataclasses import dataclass
+import http.client
+from concurrent.futures import Executor, ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
-import urllib.request
-import urllib.error
+from typing import Any, Callable, Iterable, Optional, TypeGuard
+from urllib.parse import urlparse, unquote_plus
+
+# Vector clock: {node_id: counter}
+Vector = dict[str, int]
+# Replicated update as sent between peers: {'key', 'value', 'timestamp', 'vector'}
+ReplEntry = dict[str, Any]
+
+# Idle keep-alive connections kept per peer
+MAX_IDLE_PEER_CONNS = 4
+# Server side: keep-alive connections idle this long are closed
+KEEPALIVE_IDLE_TIMEOUT = 30.0
+# Updates to the same peer within this window are sent as one batch
+REPLICATION_BATCH_WINDOW = 0.01
+
+# Compact JSON for peer traffic and API responses
+_json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+# Replication retries: attempts per batch and decorrelated-jitter backoff bounds
+MAX_REPLICATION_ATTEMPTS = 3
+RETRY_BASE_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+# Consecutive failures after which a peer's circuit breaker opens, and
+# the cap on how long it stays open
+BREAKER_THRESHOLD = 3
+MAX_BREAKER_COOLDOWN = 30.0
+# States a call passes a breaker in; a half-open call is the probe
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
+# Request bodies up to this size are read into a reused per-thread buffer
+MAX_CACHED_BODY_SIZE = 64 * 1024
+_body_buffers = threading.local()
+
+# Headers sent with every peer request
+_PEER_HEADERS = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+
+log = logging.getLogger('node')
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records unformatted so formatting happens on the listener thread"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(quiet: bool = False) -> logging.handlers.QueueListener:
+    """
+    Route node logging through a queue drained by a background thread,
+    so request handlers never block on stdout
+    Returns the started listener; stop it on shutdown to flush
+    """
+    records: queue.SimpleQueue[Any] = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(records, stream)
+    
+    log.addHandler(_LazyQueueHandler(records))
+    log.setLevel(logging.WARNING if quiet else logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
+
 
 class LamportClock:
     """Lamport logical clock implementation"""
-    def __init__(self):
-        self.time = 0
+    def __init__(self) -> None:
+        self.time: int = 0
         self.lock = threading.Lock()
     
-    def increment(self):
+    def increment(self) -> int:
         """Increment clock for local event"""
         with self.lock:
             self.time += 1
             return self.time
     
-    def update(self, received_time):
+    def update(self, received_time: int) -> int:
         """Update clock on message receipt"""
         with self.lock:
             self.time = max(self.time, received_time) + 1
             return self.time
     
-    def get_time(self):
-        """Get current clock value"""
+    def get_time(self) -> int:
+        """Get current clock value (a single int read needs no lock)"""
+        return self.time
+
+
+class VectorClock:
+    """Vector clock keyed by node ID, for detecting concurrent writes"""
+    def __init__(self, node_id: str) -> None:
+        self.node_id = node_id
+        self.vector: Vector = {}
+        self.lock = threading.Lock()
+    
+    def increment(self) -> Vector:
+        """Advance own entry for a local event, returning a copy"""
         with self.lock:
-            return self.time
+            self.vector[self.node_id] = self.vector.get(self.node_id, 0) + 1
+            return dict(self.vector)
+    
+    def update(self, received: Vector) -> Vector:
+        """Merge a received vector (elementwise max) and advance own entry"""
+        with self.lock:
+            for node_id, counter in received.items():
+                if counter > self.vector.get(node_id, 0):
+                    self.vector[node_id] = counter
+            self.vector[self.node_id] = self.vector.get(self.node_id, 0) + 1
+            return dict(self.vector)
+    
+    def get_vector(self) -> Vector:
+        """Get a copy of the current vector"""
+        with self.lock:
+            return dict(self.vector)
+
+
+def vector_leq(a: Vector, b: Vector) -> bool:
+    """True if vector a happened before or equals vector b"""
+    return all(counter <= b.get(node_id, 0) for node_id, counter in a.items())
+
+
+def merge_vectors(vectors: Iterable[Vector]) -> Vector:
+    """Elementwise max of several vectors"""
+    merged: Vector = {}
+    for vector in vectors:
+        for node_id, counter in vector.items():
+            if counter > merged.get(node_id, 0):
+                merged[node_id] = counter
+    return merged
+
+
+@dataclass(slots=True)
+class Entry:
+    """One stored version of a key; never mutated once stored"""
+    value: Any
+    timestamp: int
+    node: str
+    vector: Vector
+    siblings: tuple['Entry', ...] = ()  # Concurrent versions that lost the tie-break
+    
+    def to_dict(self) -> dict[str, Any]:
+        """JSON-ready form for API responses"""
+        return {
+            'value': self.value,
+            'timestamp': self.timestamp,
+            'node': self.node,
+            'vector': self.vector,
+            'siblings': [s.to_dict() for s in self.siblings]
+        }
+
+
+# Store log record header: Lamport timestamp, payload length
+_LOG_RECORD_HEADER = struct.Struct('<QI')
+
+
+class AppendLog:
+    """
+    Append-only log of length-prefixed records with group commit
+    Appends are staged in memory; a flusher thread writes everything staged
+    with one writev() and one fsync() per group, so an acknowledged write
+    may be lost if the process dies within the flush interval
+    A group that fails is cut back off the file and retried
+    """
+    def __init__(self, path: str, flush_interval: float = 0.005,
+                 retry_delay: float = 1.0) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # End of the last fully written group, and whether a failed group
+        # may have left bytes past it
+        self._size = os.fstat(self._fd).st_size
+        self._torn = False
+        self._flush_interval = flush_interval
+        self._retry_delay = retry_delay
+        self._staged: list[bytes] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name='log-flusher', daemon=True)
+        self._flusher.start()
+    
+    def append(self, timestamp: int, payload: bytes) -> None:
+        """Stage one record for the next group commit"""
+        header = _LOG_RECORD_HEADER.pack(timestamp, len(payload))
+        with self._cond:
+            if self._closed:
+                raise ValueError(f"Append to closed log {self.path}")
+            self._staged.append(header)
+            self._staged.append(payload)
+            self._cond.notify()
+    
+    def close(self) -> None:
+        """Flush anything staged and close the file"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
+        os.close(self._fd)
+    
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._staged and not self._closed:
+                    self._cond.wait()
+                if not self._staged:
+                    return
+            # Give concurrent writers a moment to join this group
+            if not self._closed:
+                time.sleep(self._flush_interval)
+            with self._cond:
+                chunks, self._staged = self._staged, []
+            size = sum(len(c) for c in chunks)
+            try:
+                if self._torn:
+                    os.ftruncate(self._fd, self._size)
+                    self._torn = False
+                self._write(chunks)
+                os.fsync(self._fd)
+            except OSError as e:
+                self._torn = True
+                with self._cond:
+                    closed = self._closed
+                    if not closed:
+                        self._staged[:0] = chunks
+                if closed:
+                    log.error("Failed to write %d byte(s) to %s, dropping them: %s",
+                              size, self.path, e)
+                    return
+                log.error("Failed to write %d byte(s) to %s, retrying: %s", size, self.path, e)
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, self._retry_delay)
+            else:
+                self._size += size
+    
+    def _write(self, chunks: list[bytes]) -> None:
+        iov_max = 1024
+        for start in range(0, len(chunks), iov_max):
+            group = chunks[start:start + iov_max]
+            total = sum(len(c) for c in group)
+            written = os.writev(self._fd, group)
+            if written < total:
+                # Short write: finish the group with plain write() calls
+                rest = memoryview(b''.join(group))[written:]
+                while rest:
+                    rest = rest[os.write(self._fd, rest):]
+    
+    @staticmethod
+    def read_records(path: str) -> list[tuple[int, bytes]]:
+        """
+        Read all complete records from a log file
+        A torn record at the end (crash mid-write) is cut off, so later
+        appends follow the last complete record
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        
+        records: list[tuple[int, bytes]] = []
+        offset = 0
+        while offset + _LOG_RECORD_HEADER.size <= len(data):
+            timestamp, length = _LOG_RECORD_HEADER.unpack_from(data, offset)
+            start = offset + _LOG_RECORD_HEADER.size
+            if start + length > len(data):
+                break
+            records.append((timestamp, data[start:start + length]))
+            offset = start + length
+        if offset != len(data):
+            log.warning("Truncating %d byte(s) of incomplete record at end of %s",
+                        len(data) - offset, path)
+            os.truncate(path, offset)
+        return records
 
 
 class KeyValueStore:
-    """Replicated key-value store with timestamps"""
-    def __init__(self):
-        self.store = {}  # {key: {'value': val, 'timestamp': ts, 'node': node_id}}
-        self.lock = threading.Lock()
+    """Replicated key-value store with timestamps, striped across locked shards"""
+    def __init__(self, num_shards: int = 16, log_path: Optional[str] = None) -> None:
+        # Round up to a power of two so a shard is picked with a mask
+        size = 1
+        while size < num_shards:
+            size *= 2
+        self._mask = size - 1
+        self.shards: list[tuple[dict[str, Entry], threading.Lock]] = [
+            ({}, threading.Lock()) for _ in range(size)
+        ]
+        
+        # Highest stamps seen while replaying the log, for resuming clocks
+        self.recovered_timestamp = 0
+        self.recovered_vector: Vector = {}
+        self._log: Optional[AppendLog] = None
+        if log_path:
+            self._replay(log_path)
+            self._log = AppendLog(log_path)
     
-    def put(self, key, value, timestamp, node_id):
+    def _replay(self, log_path: str) -> None:
+        records = AppendLog.read_records(log_path)
+        records.sort(key=lambda r: r[0])
+        vectors = []
+        for timestamp, payload in records:
+            key, value, node_id, vector = json.loads(payload)
+            store = self._shard(key)[0]
+            self._put_locked(store, key, value, timestamp, node_id, vector)
+            vectors.append(vector)
+        if records:
+            self.recovered_timestamp = records[-1][0]
+            self.recovered_vector = merge_vectors(vectors)
+        log.info("Recovered %d record(s) from %s", len(records), log_path)
+    
+    def _log_put(self, key: str, value: Any, timestamp: int, node_id: str, vector: Vector) -> None:
+        if self._log is not None:
+            payload = _json_encode([key, value, node_id, vector]).encode('utf-8')
+            self._log.append(timestamp, payload)
+    
+    def close(self) -> None:
+        """Flush and close the log, if any; later writes raise"""
+        if self._log is not None:
+            self._log.close()
+    
+    def _shard(self, key: str) -> tuple[dict[str, Entry], threading.Lock]:
+        return self.shards[hash(key) & self._mask]
+    
+    def put(self, key: str, value: Any, timestamp: int, node_id: str, vector: Vector) -> bool:
         """
-        Store key-value with timestamp (Last-Writer-Wins)
+        Store key-value with its vector clock
+        Updates superseded by a stored version are rejected; concurrent ones
+        are kept as siblings, and (timestamp, node) picks the visible winner
         Returns True if update was applied, False if rejected
         """
-        with self.lock:
-            if key not in self.store or timestamp > self.store[key]['timestamp']:
-                self.store[key] = {
-                    'value': value,
-                    'timestamp': timestamp,
-                    'node': node_id
-                }
-                return True
+        store, lock = self._shard(key)
+        with lock:
+            applied = self._put_locked(store, key, value, timestamp, node_id, vector)
+        if applied:
+            self._log_put(key, value, timestamp, node_id, vector)
+        return applied
+    
+    def maybe_stale(self, key: str, vector: Vector) -> bool:
+        """
+        Lock-free pre-check: True if a stored version already supersedes vector
+        Safe without the shard lock because stored entries are never mutated;
+        put() repeats the check under the lock
+        """
+        current = self.shards[hash(key) & self._mask][0].get(key)
+        if current is None:
+            return False
+        return vector_leq(vector, current.vector) or any(
+            vector_leq(vector, s.vector) for s in current.siblings)
+    
+    def put_many(self, entries: list[ReplEntry], node_id: str) -> list[bool]:
+        """
+        Apply a batch of entries from one node, taking each shard lock once
+        Returns a list of applied flags in entry order
+        """
+        by_shard: dict[int, list[int]] = {}
+        for i, entry in enumerate(entries):
+            if self.maybe_stale(entry['key'], entry['vector']):
+                continue
+            by_shard.setdefault(hash(entry['key']) & self._mask, []).append(i)
+        
+        applied = [False] * len(entries)
+        for shard_index, indices in by_shard.items():
+            store, lock = self.shards[shard_index]
+            with lock:
+                for i in indices:
+                    e = entries[i]
+                    applied[i] = self._put_locked(store, e['key'], e['value'], e['timestamp'],
+                                                  node_id, e['vector'])
+        for e, ok in zip(entries, applied):
+            if ok:
+                self._log_put(e['key'], e['value'], e['timestamp'], node_id, e['vector'])
+        return applied
+    
+    @staticmethod
+    def _put_locked(store: dict[str, Entry], key: str, value: Any, timestamp: int,
+                    node_id: str, vector: Vector) -> bool:
+        current = store.get(key)
+        if current is None:
+            store[key] = Entry(value, timestamp, node_id, vector)
+            return True
+        
+        versions = [Entry(current.value, current.timestamp, current.node, current.vector),
+                    *current.siblings]
+        if any(vector_leq(vector, v.vector) for v in versions):
             return False
+        
+        # Drop versions the update supersedes, keep concurrent ones
+        versions = [v for v in versions if not vector_leq(v.vector, vector)]
+        versions.append(Entry(value, timestamp, node_id, vector))
+        versions.sort(key=lambda v: (v.timestamp, v.node), reverse=True)
+        winner = versions[0]
+        store[key] = Entry(winner.value, winner.timestamp, winner.node, winner.vector,
+                           tuple(versions[1:]))
+        return True
     
-    def get(self, key):
+    def get(self, key: str) -> Optional[Entry]:
         """Retrieve value for key"""
-        with self.lock:
-            return self.store.get(key)
+        store, lock = self._shard(key)
+        with lock:
+            return store.get(key)
     
-    def get_all(self):
-        """Get all stored data"""
-        with self.lock:
-            return dict(self.store)
+    def get_all(self) -> dict[str, Entry]:
+        """
+        Get all stored data
+        Each shard is copied under its own lock, so the snapshot is not
+        atomic across shards
+        """
+        result: dict[str, Entry] = {}
+        for store, lock in self.shards:
+            with lock:
+                result.update(store)
+        return result
+
+
+class RecentSet:
+    """
+    Exact set of recently seen items, aged out by rotating two generations
+    Remembers at least the last generation_size items
+    """
+    def __init__(self, generation_size: int = 100_000) -> None:
+        self._generation_size = generation_size
+        self._current: set[Any] = set()
+        self._previous: set[Any] = set()
+        self._lock = threading.Lock()
+    
+    def __contains__(self, item: Any) -> bool:
+        with self._lock:
+            return item in self._current or item in self._previous
+    
+    def update(self, items: Iterable[Any]) -> None:
+        """Record items as seen"""
+        with self._lock:
+            for item in items:
+                self._current.add(item)
+                if len(self._current) >= self._generation_size:
+                    self._previous = self._current
+                    self._current = set()
+
+
+class DelayScheduler:
+    """Runs delayed tasks on an executor from a single timer thread"""
+    def __init__(self, executor: Executor) -> None:
+        self._executor = executor
+        # heap of (due, seq, fn, args)
+        self._queue: list[tuple[float, int, Callable[..., Any], tuple[Any, ...]]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._timer = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._timer.start()
+    
+    def call_later(self, delay: float, fn: Callable[..., Any], *args: Any) -> None:
+        """Submit fn(*args) to the executor after delay seconds"""
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq), fn, args))
+            self._cond.notify()
+    
+    def close(self) -> None:
+        """Stop the timer thread, dropping pending tasks"""
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify()
+    
+    def _run(self) -> None:
+        with self._cond:
+            while not self._closed:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                wait = self._queue[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, fn, args = heapq.heappop(self._queue)
+                self._executor.submit(fn, *args)
+
+
+class CircuitBreaker:
+    """
+    Per-peer circuit breaker: closed until BREAKER_THRESHOLD consecutive
+    failures, then open for a growing cooldown, then half-open, letting a
+    single probe through whose outcome closes or reopens it
+    """
+    def __init__(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+    
+    def admit(self) -> str:
+        """State a call passes in; BREAKER_OPEN means drop it"""
+        with self._lock:
+            if self.failures < BREAKER_THRESHOLD:
+                return BREAKER_CLOSED
+            if self.probing or time.monotonic() < self.open_until:
+                return BREAKER_OPEN
+            self.probing = True
+            return BREAKER_HALF_OPEN
+    
+    def success(self, probe: bool) -> None:
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            if probe:
+                self.probing = False
+    
+    def failure(self, probe: bool) -> None:
+        with self._lock:
+            if probe:
+                self.probing = False
+            self.failures += 1
+            if self.failures >= BREAKER_THRESHOLD:
+                cooldown = min(MAX_BREAKER_COOLDOWN, 2 ** self.failures) * random.uniform(0.5, 1.5)
+                self.open_until = time.monotonic() + cooldown
+
+
+class PeerHTTPError(http.client.HTTPException):
+    """A peer answered with a status other than 200"""
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
 
 
 class Node:
     """Distributed node with Lamport clock and KV store"""
-    def __init__(self, node_id, port, peers):
+    def __init__(self, node_id: str, port: int, peers: list[str], store_shards: int = 16,
+                 peer_delays: Optional[dict[str, float]] = None,
+                 log_path: Optional[str] = None) -> None:
         self.node_id = node_id
         self.port = port
         self.peers = peers  # List of peer URLs
         self.clock = LamportClock()
-        self.store = KeyValueStore()
-        self.delay_peer = None  # For Scenario A: artificial delay
-        self.delay_seconds = 0
+        self.vclock = VectorClock(node_id)
+        self.store = KeyValueStore(store_shards, log_path)
+        # (source_node, timestamp, key) of recent replications, to drop retried duplicates
+        self._seen_replications = RecentSet()
+        # Resume both clocks past everything recovered from the log
+        if self.store.recovered_timestamp:
+            self.clock.update(self.store.recovered_timestamp)
+            self.vclock.update(self.store.recovered_vector)
+        # Scenario A: artificial replication delay per peer URL, in seconds
+        peer_delays = peer_delays or {}
+        self._peer_delay = {peer_url: peer_delays.get(peer_url, 0) for peer_url in peers}
+        
+        # Persistent HTTP connections to peers, reused across replications
+        self._peer_addrs: dict[str, tuple[str, int]] = {}
+        for peer_url in peers:
+            parsed = urlparse(peer_url)
+            self._peer_addrs[peer_url] = (parsed.hostname or '', parsed.port or 80)
+        self._peer_conns: dict[str, list[http.client.HTTPConnection]] = {
+            peer_url: [] for peer_url in peers
+        }
+        self._peer_conns_lock = threading.Lock()
+        self._breakers = {peer_url: CircuitBreaker() for peer_url in peers}
+        # Static head of every batch message: {"source_node":...,"entries":[...]}
+        self._batch_prefix = ('{"source_node":%s,"entries":' % _json_encode(node_id)).encode('utf-8')
         
-    def handle_put(self, key, value):
+        # Bounded worker pool for outgoing replication
+        self._repl_pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(peers)),
+                                             thread_name_prefix='repl')
+        # Delayed replications wait here instead of sleeping on a worker
+        self._scheduler = DelayScheduler(self._repl_pool)
+        # Updates waiting for the next batch to each peer
+        self._pending: dict[str, list[ReplEntry]] = {peer_url: [] for peer_url in peers}
+        self._pending_lock = threading.Lock()
+        
+    def handle_put(self, key: str, value: Any) -> dict[str, Any]:
         """Handle PUT request"""
         # Increment Lamport clock for local event
         timestamp = self.clock.increment()
+        vector = self.vclock.increment()
         
         # Update local store
-        self.store.put(key, value, timestamp, self.node_id)
+        self.store.put(key, value, timestamp, self.node_id, vector)
         
-        print(f"[{self.node_id}] PUT {key}={value} at Lamport time {timestamp}")
+        log.info("[%s] PUT %s=%s at Lamport time %d (vector=%s)",
+                 self.node_id, key, value, timestamp, vector)
         
         # Replicate to all peers
-        self._replicate_to_peers(key, value, timestamp)
+        self._replicate_to_peers(key, value, timestamp, vector)
         
-        return {'status': 'ok', 'timestamp': timestamp, 'node': self.node_id}
+        return {'status': 'ok', 'timestamp': timestamp, 'vector': vector, 'node': self.node_id}
     
-    def handle_get(self, key):
+    def handle_get(self, key: str) -> dict[str, Any]:
         """Handle GET request"""
         data = self.store.get(key)
         if data:
             return {
                 'status': 'ok',
                 'key': key,
-                'value': data['value'],
-                'timestamp': data['timestamp'],
-                'node': data['node']
+                'value': data.value,
+                'timestamp': data.timestamp,
+                'vector': data.vector,
+                'node': data.node,
+                'siblings': [s.to_dict() for s in data.siblings]
             }
         else:
             return {'status': 'not_found', 'key': key}
     
-    def handle_replicate(self, key, value, timestamp, source_node):
+    def handle_replicate(self, key: str, value: Any, timestamp: int, source_node: str,
+                         vector: Vector) -> dict[str, Any]:
         """Handle replication request from peer"""
-        # Update Lamport clock with received timestamp
+        # A retried message that was already applied needs no clock or store work
+        seen_key = (source_node, timestamp, key)
+        if seen_key in self._seen_replications:
+            return {'status': 'ok', 'applied': False, 'dup': True}
+        
+        # Update both clocks with the received stamps
         local_time = self.clock.update(timestamp)
+        self.vclock.update(vector)
         
-        # Apply update using LWW
-        applied = self.store.put(key, value, timestamp, source_node)
+        # Apply update, keeping concurrent versions as siblings; stale
+        # updates are turned away before taking the store lock
+        if self.store.maybe_stale(key, vector):
+            applied = False
+        else:
+            applied = self.store.put(key, value, timestamp, source_node, vector)
+        # Only once handled, so a retry after a failure above is applied again
+        self._seen_replications.update((seen_key,))
         
         if applied:
-            print(f"[{self.node_id}] REPLICATE {key}={value} from {source_node} "
-                  f"(ts={timestamp}, local_clock={local_time})")
+            log.info("[%s] REPLICATE %s=%s from %s (ts=%d, local_clock=%d)",
+                     self.node_id, key, value, source_node, timestamp, local_time)
         else:
-            print(f"[{self.node_id}] REJECTED {key}={value} from {source_node} "
-                  f"(ts={timestamp}, existing timestamp is higher)")
+            log.info("[%s] REJECTED %s=%s from %s (ts=%d, superseded by existing version)",
+                     self.node_id, key, value, source_node, timestamp)
         
         return {'status': 'ok', 'applied': applied}
     
-    def handle_status(self):
+    def handle_replicate_batch(self, entries: list[ReplEntry], source_node: str) -> dict[str, Any]:
+        """Handle a batch of replicated updates from one peer"""
+        # Drop entries already received, e.g. from a retried batch
+        seen = self._seen_replications
+        is_dup = [(source_node, e['timestamp'], e['key']) in seen for e in entries]
+        fresh = [e for e, dup in zip(entries, is_dup) if not dup]
+        if not fresh:
+            return {'status': 'ok', 'applied': [False] * len(entries), 'duplicates': len(entries)}
+        
+        # One message, one receive event for the Lamport clock
+        local_time = self.clock.update(max(e['timestamp'] for e in fresh))
+        self.vclock.update(merge_vectors(e['vector'] for e in fresh))
+        
+        fresh_applied = self.store.put_many(fresh, source_node)
+        # Marked last, as in handle_replicate
+        seen.update((source_node, e['timestamp'], e['key']) for e in fresh)
+        
+        for entry, ok in zip(fresh, fresh_applied):
+            if ok:
+                log.info("[%s] REPLICATE %s=%s from %s (ts=%d, local_clock=%d)", self.node_id,
+                         entry['key'], entry['value'], source_node, entry['timestamp'], local_time)
+            else:
+                log.info("[%s] REJECTED %s=%s from %s (ts=%d, superseded by existing version)",
+                         self.node_id, entry['key'], entry['value'], source_node, entry['timestamp'])
+        
+        remaining = iter(fresh_applied)
+        applied = [False if dup else next(remaining) for dup in is_dup]
+        return {'status': 'ok', 'applied': applied, 'duplicates': len(entries) - len(fresh)}
+    
+    def handle_status(self) -> dict[str, Any]:
         """Return node status"""
-        all_data = self.store.get_all()
+        all_data = {key: entry.to_dict() for key, entry in self.store.get_all().items()}
         return {
             'node_id': self.node_id,
             'lamport_time': self.clock.get_time(),
+            'vector_clock': self.vclock.get_vector(),
             'store': all_data,
             'peers': self.peers
         }
     
-    def _replicate_to_peers(self, key, value, timestamp):
+    def close(self) -> None:
+        """Stop replication workers, drop pooled peer connections and flush the log"""
+        self._scheduler.close()
+        self._repl_pool.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+        with self._peer_conns_lock:
+            for idle in self._peer_conns.values():
+                for conn in idle:
+                    conn.close()
+                idle.clear()
+    
+    def _replicate_to_peers(self, key: str, value: Any, timestamp: int, vector: Vector) -> None:
         """Replicate update to all peer nodes"""
+        entry = {'key': key, 'value': value, 'timestamp': timestamp, 'vector': vector}
         for peer_url in self.peers:
-            # Scenario A: Add artificial delay for specific peer
-            delay = 0
-            if self.delay_peer and peer_url == self.delay_peer:
-                delay = self.delay_seconds
+            delay = self._peer_delay[peer_url]
+            if delay > 0:
+                log.info("[%s] Delaying replication to %s by %ss", self.node_id, peer_url, delay)
+                self._scheduler.call_later(delay, self._queue_replication, peer_url, entry)
+            else:
+                self._queue_replication(peer_url, entry)
+    
+    def _queue_replication(self, peer_url: str, entry: ReplEntry) -> None:
+        """Add an update to the peer's next batch, scheduling a flush if needed"""
+        with self._pending_lock:
+            pending = self._pending[peer_url]
+            pending.append(entry)
+            first = len(pending) == 1
+        if first:
+            self._scheduler.call_later(REPLICATION_BATCH_WINDOW, self._flush_replication, peer_url)
+    
+    def _flush_replication(self, peer_url: str) -> None:
+        """Send everything queued for a peer as one batch"""
+        with self._pending_lock:
+            entries = self._pending[peer_url]
+            self._pending[peer_url] = []
+        if entries:
+            self._replicate_to_peer(peer_url, entries)
+    
+    def _replicate_to_peer(self, peer_url: str, entries: list[ReplEntry]) -> None:
+        """Replicate a batch to a single peer with retry logic"""
+        body = self._batch_prefix + _json_encode(entries).encode('utf-8') + b'}'
+        self._send_batch(peer_url, entries, body, 1, RETRY_BASE_DELAY)
+    
+    def _send_batch(self, peer_url: str, entries: list[ReplEntry], body: bytes,
+                    attempt: int, backoff: float) -> None:
+        """
+        Make one delivery attempt; retries are scheduled rather than slept,
+        so a down peer never holds a replication worker
+        """
+        breaker = self._breakers[peer_url]
+        admitted = breaker.admit()
+        if admitted == BREAKER_OPEN:
+            log.warning("[%s] Circuit open for %s, dropping %d update(s)",
+                        self.node_id, peer_url, len(entries))
+            return
+        probe = admitted == BREAKER_HALF_OPEN
+        
+        try:
+            result = self._post_to_peer(peer_url, '/replicate_batch', body)
+        except Exception as e:
+            if isinstance(e, PeerHTTPError) and e.status < 500:
+                # The peer is up but turned the batch down; resending won't help
+                breaker.success(probe)
+                log.error("[%s] %s rejected %d update(s): %s",
+                          self.node_id, peer_url, len(entries), e)
+                return
+            breaker.failure(probe)
+            log.warning("[%s] Replication to %s failed (attempt %d): %s",
+                        self.node_id, peer_url, attempt, e)
             
-            # Run replication in separate thread
-            thread = threading.Thread(
-                target=self._replicate_to_peer,
-                args=(peer_url, key, value, timestamp, delay)
-            )
-            thread.daemon = True
-            thread.start()
-    
-    def _replicate_to_peer(self, peer_url, key, value, timestamp, delay=0):
-        """Replicate to a single peer with retry logic"""
-        if delay > 0:
-            print(f"[{self.node_id}] Delaying replication to {peer_url} by {delay}s")
-            time.sleep(delay)
-        
-        data = {
-            'key': key,
-            'value': value,
-            'timestamp': timestamp,
-            'source_node': self.node_id
-        }
+            # A failed probe reopens the breaker instead of retrying
+            if not probe and attempt < MAX_REPLICATION_ATTEMPTS:
+                # Decorrelated jitter
+                backoff = min(MAX_RETRY_DELAY, random.uniform(RETRY_BASE_DELAY, backoff * 3))
+                self._scheduler.call_later(backoff, self._send_batch,
+                                           peer_url, entries, body, attempt + 1, backoff)
+            else:
+                log.error("[%s] Failed to replicate %d update(s) to %s after %d attempts",
+                          self.node_id, len(entries), peer_url, attempt)
+            return
+        
+        breaker.success(probe)
+        log.info("[%s] Replicated %d update(s) to %s: %s",
+                 self.node_id, len(entries), peer_url, result)
+    
+    def _post_to_peer(self, peer_url: str, path: str, body: bytes) -> Any:
+        """POST a JSON body to a peer over a pooled keep-alive connection"""
+        conn: Optional[http.client.HTTPConnection]
+        with self._peer_conns_lock:
+            idle = self._peer_conns[peer_url]
+            conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            host, port = self._peer_addrs[peer_url]
+            conn = http.client.HTTPConnection(host, port, timeout=5)
         
-        max_retries = 3
-        for attempt in range(max_retries):
+        try:
             try:
-                req = urllib.request.Request(
-                    f"{peer_url}/replicate",
-                    data=json.dumps(data).encode('utf-8'),
-                    headers={'Content-Type': 'application/json'}
-                )
-                
-                with urllib.request.urlopen(req, timeout=5) as response:
-                    result = json.loads(response.read().decode('utf-8'))
-                    print(f"[{self.node_id}] Replicated to {peer_url}: {result}")
-                    return
-                    
-            except Exception as e:
-                print(f"[{self.node_id}] Replication to {peer_url} failed (attempt {attempt+1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # Exponential backoff
+                conn.request('POST', path, body, _PEER_HEADERS)
+                response = conn.getresponse()
+            except (http.client.BadStatusLine, ConnectionError):
+                if not reused:
+                    raise
+                # The peer closed the idle connection; retry once on a fresh one
+                conn.close()
+                conn.request('POST', path, body, _PEER_HEADERS)
+                response = conn.getresponse()
+            payload = response.read()
+        except Exception:
+            conn.close()
+            raise
         
-        print(f"[{self.node_id}] Failed to replicate to {peer_url} after {max_retries} attempts")
+        if response.will_close:
+            conn.close()
+        else:
+            with self._peer_conns_lock:
+                idle = self._peer_conns[peer_url]
+                if len(idle) < MAX_IDLE_PEER_CONNS:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        
+        if response.status != 200:
+            raise PeerHTTPError(response.status, f"HTTP {response.status} from {peer_url}{path}")
+        return json.loads(payload)
+
+
+def _is_timestamp(value: Any) -> TypeGuard[int]:
+    """A Lamport timestamp as received: a positive int that fits the log record header"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value < 2 ** 64
+
+
+def _is_vector(value: Any) -> TypeGuard[Vector]:
+    """A vector clock as received: node IDs (JSON keys are str) to non-negative ints"""
+    return isinstance(value, dict) and all(
+        isinstance(c, int) and not isinstance(c, bool) and c >= 0 for c in value.values()
+    )
+
+
+def _is_repl_entry(value: Any) -> bool:
+    """A replicated update as received in a batch"""
+    if not isinstance(value, dict):
+        return False
+    key = value.get('key')
+    return (isinstance(key, str) and key != '' and value.get('value') is not None
+            and _is_timestamp(value.get('timestamp')) and _is_vector(value.get('vector')))
+
+
+def _query_param(query: str, name: str) -> Optional[str]:
+    """First value of a query-string parameter, or None"""
+    prefix = name + '='
+    for pair in query.split('&'):
+        if pair.startswith(prefix):
+            value = pair[len(prefix):]
+            if '%' in value or '+' in value:
+                value = unquote_plus(value)
+            return value
+    return None
 
 
 class RequestHandler(BaseHTTPRequestHandler):
     """HTTP request handler for node API"""
+    protocol_version = 'HTTP/1.1'  # Keep-alive for pooled peer connections
+    timeout = 5  # Bounds a single request; idle waits happen in the server's selector
+    # Headers and body go out in separate writes; with Nagle on, a kept-alive
+    # client's delayed ACK holds back the body for ~40ms
+    disable_nagle_algorithm = True
+    server: 'ThreadPoolHTTPServer'
     
-    def do_GET(self):
+    def handle(self) -> None:
+        """Serve one request; the server parks the connection until the next one"""
+        self.close_connection = True
+        self.handle_one_request()
+    
+    def finish(self) -> None:
+        """Keep the socket files open while the connection stays alive"""
+        if self.close_connection:
+            super().finish()
+    
+    def serve_next(self) -> None:
+        """Serve the next request on a connection the server kept open"""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+    
+    def has_buffered_input(self) -> bool:
+        """Whether bytes of the next request are already read, so the selector would not see them"""
+        if not isinstance(self.rfile, io.BufferedReader):
+            return False
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
+    def do_GET(self) -> None:
         """Handle GET requests"""
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
-        params = parse_qs(parsed_path.query)
-        
-        if path == '/get':
-            key = params.get('key', [None])[0]
-            if not key:
-                self._send_response(400, {'error': 'Missing key parameter'})
-                return
-            
-            result = self.server.node.handle_get(key)
-            self._send_response(200, result)
-            
-        elif path == '/status':
-            result = self.server.node.handle_status()
-            self._send_response(200, result)
-            
-        else:
+        path, _, query = self.path.partition('?')
+        route = ROUTES.get(('GET', path))
+        if route is None:
             self._send_response(404, {'error': 'Not found'})
+            return
+        route(self, query)
     
-    def do_POST(self):
+    def do_POST(self) -> None:
         """Handle POST requests"""
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
+        path = self.path.partition('?')[0]
         
         # Read request body
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length).decode('utf-8')
-        
         try:
+            body = self._read_body()
+            if body is None:
+                self.close_connection = True
+                self._send_response(400, {'error': 'Incomplete body'})
+                return
             data = json.loads(body) if body else {}
-        except json.JSONDecodeError:
+        except ValueError:  # Malformed JSON or invalid UTF-8
             self._send_response(400, {'error': 'Invalid JSON'})
             return
+        if not isinstance(data, dict):
+            self._send_response(400, {'error': 'Expected a JSON object'})
+            return
         
-        if path == '/put':
-            key = data.get('key')
-            value = data.get('value')
-            
-            if not key or value is None:
-                self._send_response(400, {'error': 'Missing key or value'})
-                return
-            
-            result = self.server.node.handle_put(key, value)
-            self._send_response(200, result)
-            
-        elif path == '/replicate':
-            key = data.get('key')
-            value = data.get('value')
-            timestamp = data.get('timestamp')
-            source_node = data.get('source_node')
-            
-            if not all([key, value is not None, timestamp, source_node]):
-                self._send_response(400, {'error': 'Missing required fields'})
-                return
-            
-            result = self.server.node.handle_replicate(key, value, timestamp, source_node)
-            self._send_response(200, result)
-            
-        else:
+        route = ROUTES.get(('POST', path))
+        if route is None:
             self._send_response(404, {'error': 'Not found'})
+            return
+        route(self, data)
     
-    def _send_response(self, status_code, data):
-        """Send JSON response"""
+    def _route_get(self, query: str) -> None:
+        key = _query_param(query, 'key')
+        if not key:
+            self._send_response(400, {'error': 'Missing key parameter'})
+            return
+        
+        result = self.server.node.handle_get(key)
+        self._send_response(200, result)
+    
+    def _route_status(self, query: str) -> None:
+        result = self.server.node.handle_status()
+        self._send_response(200, result, pretty=True)
+    
+    def _route_put(self, data: dict[str, Any]) -> None:
+        key = data.get('key')
+        value = data.get('value')
+        
+        if not key or value is None:
+            self._send_response(400, {'error': 'Missing key or value'})
+            return
+        if not isinstance(key, str):
+            self._send_response(400, {'error': 'Key must be a string'})
+            return
+        
+        result = self.server.node.handle_put(key, value)
+        self._send_response(200, result)
+    
+    def _route_replicate(self, data: dict[str, Any]) -> None:
+        key = data.get('key')
+        value = data.get('value')
+        timestamp = data.get('timestamp')
+        source_node = data.get('source_node')
+        vector = data.get('vector')
+        
+        if (not isinstance(key, str) or not key or value is None or not _is_timestamp(timestamp)
+                or not isinstance(source_node, str) or not source_node or not _is_vector(vector)):
+            self._send_response(400, {'error': 'Missing or invalid fields'})
+            return
+        
+        result = self.server.node.handle_replicate(key, value, timestamp, source_node, vector)
+        self._send_response(200, result)
+    
+    def _route_replicate_batch(self, data: dict[str, Any]) -> None:
+        entries = data.get('entries')
+        source_node = data.get('source_node')
+        
+        if (not isinstance(entries, list) or not entries or not isinstance(source_node, str)
+                or not source_node or not all(_is_repl_entry(e) for e in entries)):
+            self._send_response(400, {'error': 'Missing or invalid fields'})
+            return
+        
+        result = self.server.node.handle_replicate_batch(entries, source_node)
+        self._send_response(200, result)
+    
+    def _read_body(self) -> Optional[str]:
+        """
+        Read the request body into a reused per-thread buffer and decode it
+        straight to str, skipping the intermediate bytes object
+        Returns None if the client sends fewer bytes than announced
+        """
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length <= 0:
+            return ''
+        
+        buf: Optional[bytearray]
+        if content_length > MAX_CACHED_BODY_SIZE:
+            buf = bytearray(content_length)
+        else:
+            buf = getattr(_body_buffers, 'buf', None)
+            if buf is None or len(buf) < content_length:
+                size = 1024
+                while size < content_length:
+                    size *= 2
+                buf = _body_buffers.buf = bytearray(size)
+        
+        with memoryview(buf) as view, view[:content_length] as body:
+            if self.rfile.readinto(body) != content_length:
+                return None
+            return str(body, 'utf-8')
+    
+    def _send_response(self, status_code: int, data: dict[str, Any], pretty: bool = False) -> None:
+        """Send JSON response, indented only when meant for humans"""
+        if pretty:
+            body = json.dumps(data, indent=2).encode('utf-8')
+        else:
+            body = _json_encode(data).encode('utf-8')
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode('utf-8'))
+        self.wfile.write(body)
     
-    def log_message(self, format, *args):
+    def log_message(self, format: str, *args: Any) -> None:
         """Suppress default logging"""
         pass
 
 
-def main():
+# (method, path) -> route; GET routes take the query string, POST routes the parsed body
+ROUTES: dict[tuple[str, str], Callable[[RequestHandler, Any], None]] = {
+    ('GET', '/get'): RequestHandler._route_get,
+    ('GET', '/status'): RequestHandler._route_status,
+    ('POST', '/put'): RequestHandler._route_put,
+    ('POST', '/replicate'): RequestHandler._route_replicate,
+    ('POST', '/replicate_batch'): RequestHandler._route_replicate_batch,
+}
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTP server that handles requests on a bounded pool of worker threads
+    Keep-alive connections waiting for their next request are parked in a
+    selector instead of holding a worker
+    """
+    request_queue_size = 128  # Listen backlog; the default of 5 drops SYNs under bursts
+    node: Node
+
+    def __init__(self, server_address: tuple[str, int],
+                 handler_class: type[RequestHandler],
+                 max_workers: int = 16) -> None:
+        # Set up before binding: a failed bind calls server_close()
+        self._handler_class = handler_class
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='http')
+        self._closing = False
+        # Connections to park, handed to the watcher thread, which owns the selector
+        self._parked: queue.SimpleQueue[tuple[Any, Any, Optional[RequestHandler]]] = queue.SimpleQueue()
+        self._idle = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._idle.register(self._wake_r, selectors.EVENT_READ)
+        self._watcher = threading.Thread(target=self._watch_idle, name='http-idle', daemon=True)
+        self._watcher.start()
+        super().__init__(server_address, handler_class)
+    
+    def process_request(self, request: Any, client_address: Any) -> None:
+        """Wait for the first request in the selector, then serve it on a pool worker"""
+        self._park(request, client_address, None)
+    
+    def _serve(self, request: Any, client_address: Any, handler: Optional[RequestHandler]) -> None:
+        """Serve requests on a pool worker until the connection goes idle, then park it"""
+        try:
+            if handler is None:
+                handler = self._handler_class(request, client_address, self)
+            else:
+                handler.serve_next()
+            while not handler.close_connection and handler.has_buffered_input():
+                handler.serve_next()
+        except ConnectionError:  # Client went away between requests
+            self._close(request, handler)
+            return
+        except Exception:
+            self.handle_error(request, client_address)
+            self._close(request, handler)
+            return
+        if handler.close_connection or self._closing:
+            self._close(request, handler)
+            return
+        self._park(request, client_address, handler)
+    
+    def _park(self, request: Any, client_address: Any, handler: Optional[RequestHandler]) -> None:
+        self._parked.put((request, client_address, handler))
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:  # A wakeup is already pending
+            pass
+    
+    def _close(self, request: Any, handler: Optional[RequestHandler]) -> None:
+        if handler is not None and not handler.close_connection:
+            handler.close_connection = True
+            handler.finish()
+        self.shutdown_request(request)
+    
+    def _watch_idle(self) -> None:
+        """Hand parked connections back to the pool once readable; close ones idle too long"""
+        idle = self._idle
+        next_sweep = time.monotonic() + 1.0
+        while not self._closing:
+            for key, _ in idle.select(timeout=1.0):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                idle.unregister(key.fileobj)
+                client_address, handler, _ = key.data
+                self._executor.submit(self._serve, key.fileobj, client_address, handler)
+            
+            now = time.monotonic()
+            while True:
+                try:
+                    request, client_address, handler = self._parked.get_nowait()
+                except queue.Empty:
+                    break
+                idle.register(request, selectors.EVENT_READ,
+                              (client_address, handler, now + KEEPALIVE_IDLE_TIMEOUT))
+            
+            if now >= next_sweep:
+                next_sweep = now + 1.0
+                for key in list(idle.get_map().values()):
+                    if key.data is not None and key.data[2] <= now:
+                        idle.unregister(key.fileobj)
+                        self._close(key.fileobj, key.data[1])
+        self._close_parked()
+    
+    def _close_parked(self) -> None:
+        for key in list(self._idle.get_map().values()):
+            if key.data is not None:
+                self._idle.unregister(key.fileobj)
+                self._close(key.fileobj, key.data[1])
+        while True:
+            try:
+                request, _, handler = self._parked.get_nowait()
+            except queue.Empty:
+                break
+            self._close(request, handler)
+
+    def server_close(self) -> None:
+        """
+        Stop accepting, close idle connections and wait for requests in
+        flight; each is bounded by the handler timeout
+        """
+        self._closing = True
+        super().server_close()
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:
+            pass
+        self._watcher.join()
+        self._executor.shutdown(wait=True)
+        # Connections that went idle while the pool drained
+        self._close_parked()
+        self._idle.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+
+def main() -> None:
     parser = argparse.ArgumentParser(description='Distributed KV Store Node')
     parser.add_argument('--id', required=True, help='Node ID (A, B, or C)')
     parser.add_argument('--port', type=int, required=True, help='Port number')
     parser.add_argument('--peers', required=True, help='Comma-separated peer URLs')
     parser.add_argument('--delay-peer', help='Peer URL to artificially delay (Scenario A)')
     parser.add_argument('--delay-seconds', type=int, default=5, help='Delay in seconds')
+    parser.add_argument('--http-threads', type=int, default=16,
+                        help='Number of worker threads serving HTTP requests')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Only log replication failures')
+    parser.add_argument('--log-file',
+                        help='Append-only log to persist the store in and recover it from')
     
     args = parser.parse_args()
+    listener = setup_logging(args.quiet)
     
     # Parse peer list
     peers = [p.strip() for p in args.peers.split(',') if p.strip()]
     
-    # Create node
-    node = Node(args.id, args.port, peers)
-    
-    # Set delay configuration for Scenario A
+    # Delay configuration for Scenario A
+    peer_delays: dict[str, float] = {}
     if args.delay_peer:
-        node.delay_peer = args.delay_peer
-        node.delay_seconds = args.delay_seconds
+        peer_delays[args.delay_peer] = args.delay_seconds
         print(f"[{args.id}] Artificial delay configured: {args.delay_peer} ({args.delay_seconds}s)")
+        if args.delay_peer not in peers:
+            print(f"[{args.id}] Warning: {args.delay_peer} is not in the peer list")
+    
+    # Create node, with about two store shards per HTTP worker
+    node = Node(args.id, args.port, peers, store_shards=2 * args.http_threads,
+                peer_delays=peer_delays, log_path=args.log_file)
     
     # Create HTTP server
-    server = HTTPServer(('0.0.0.0', args.port), RequestHandler)
+    server = ThreadPoolHTTPServer(('0.0.0.0', args.port), RequestHandler,
+                                  max_workers=args.http_threads)
     server.node = node
     
     print(f"[{args.id}] Node started on port {args.port}")
@@ -300,7 +1211,12 @@ def main():
         server.serve_forever()
     except KeyboardInterrupt:
         print(f"\n[{args.id}] Shutting down...")
-        server.shutdown()
+    finally:
+        # Waits for in-flight requests, so every acknowledged write is
+        # staged in the log before the store closes it
+        server.server_close()
+        node.close()
+        listener.stop()
 
 
 if __name__ == '__main__':